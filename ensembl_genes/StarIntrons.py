@@ -24,6 +24,7 @@
 """
 import logging
 import pathlib
+from sqlalchemy.engine import make_url
 import eHive
 from . import star2introns
 
@@ -39,7 +40,8 @@ class StarIntrons(eHive.BaseRunnable):
         """
         defaults = super().param_defaults()
 
-        defaults["batch_size"] = 500
+        defaults["batch_size"] = 100000
+        defaults["num_threads"] = 1
         return defaults
 
     def fetch_input(self):
@@ -66,9 +68,13 @@ class StarIntrons(eHive.BaseRunnable):
             junction_files.append(filename)
 
         if len(junction_files) > 0:
-            target_url = self.param_required("intron_db").replace(
-                "mysql:", "mysql+pymysql:"
+            # only the driver of the url is changed, MySQLdb is not installed
+            target_url = (
+                make_url(self.param_required("intron_db"))
+                .set(drivername="mysql+pymysql")
+                .render_as_string(hide_password=False)
             )
+            self.param("intron_db_url", target_url)
             engine = star2introns.get_engine(target_url)
             self.param(
                 "analyses",
@@ -88,12 +94,15 @@ class StarIntrons(eHive.BaseRunnable):
         """Process all the files found in 'junctions_dir'.
 
         It will collapse all the introns which are from the same sample, the score representing
-        the number of reads overlapping the splice site.
+        the number of reads overlapping the splice site. The files are parsed by
+        'num_threads' processes.
         """
 
-        daf_table = {}
-        for filename in self.param("junction_files"):
-            star2introns.process_file(filename, self.param("analyses"), daf_table)
+        daf_table = star2introns.process_files(
+            self.param("junction_files"),
+            self.param("analyses"),
+            self.param("num_threads"),
+        )
 
         self.param("output", daf_table)
 
@@ -101,7 +110,7 @@ class StarIntrons(eHive.BaseRunnable):
         """Write the introns into the dna_align_feature table."""
 
         star2introns.write_output(
-            self.param("engine"),
+            star2introns.get_engine(self.param("intron_db_url")),
             self.param("analyses"),
             self.param("slices"),
             self.param("output"),
@@ -31,16 +31,26 @@ Examples:
 
 """
 
-from typing import Dict, Optional
+from typing import IO, Dict, Iterable, Optional, Tuple
 import sys
+from sys import intern
 import logging
 import argparse
-from re import search
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from math import ceil
+from operator import itemgetter
 import csv
+from collections import Counter
+import tempfile
 import sqlalchemy as db
-from sqlalchemy.engine import Engine  # Needed for typing
+from sqlalchemy.engine import Connection, Engine  # Needed for typing
+
+# start, end, strand and motif of an intron
+IntronId = Tuple[int, int, int, int]
+
+READ_BUFFER_SIZE = 1024 * 1024
+# seq_region, start, end, strand, motif, unique reads and multi-mapping reads
+JUNCTION_COLUMNS = itemgetter(0, 1, 2, 3, 4, 6, 7)
 
 
 def get_engine(url: str) -> Engine:
@@ -52,7 +62,8 @@ def get_engine(url: str) -> Engine:
     Returns:
         SQLAlchemy engine.
     """
-    return db.create_engine(url)
+    # LOAD DATA LOCAL INFILE is refused by the server unless the client allows it
+    return db.create_engine(url, connect_args={"local_infile": True})
 
 
 def fetch_species_name(engine: Engine) -> str:
@@ -126,12 +137,12 @@ def fetch_slice_ids(engine: Engine) -> Dict[str, int]:
 def process_file(
     filename: Path,
     analyses: Dict[str, str],
-    daf_table: Optional[Dict[str, Dict[str, Dict[str, int]]]] = None,
-) -> Dict[str, Dict[str, Dict[str, int]]]:
+    daf_table: Optional[Dict[Tuple[str, IntronId, str], int]] = None,
+) -> Dict[Tuple[str, IntronId, str], int]:
     """Parses a STAR junctions file
 
-    It stores the information in a complex dictionary structure:
-    seq_region->position->logic_name
+    It stores the information in a flat dictionary keyed by
+    (seq_region, position, logic_name)
 
     Args:
         filename: Path of file to process.
@@ -139,135 +150,251 @@ def process_file(
         daf_table: Dictionary for storing the depth of the intron depending on the sample.
 
     Returns:
-        A structure of dictionaries storing the intron information:
-            dict[seq_region,
-                dict[intron_id,
-                    dict[analysis, depth]
-                    ]
-                ]
+        A dictionary storing the intron information:
+            dict[(seq_region, intron_id, analysis), depth]
     """
 
     logger = logging.getLogger("star2introns")
     logger.debug("Processing %s", filename.name)
-    file_id = search("^([^_]+)", filename.name)
     if daf_table is None:
         daf_table = {}
-    if file_id:
-        try:
-            logic_name = analyses[file_id.group(1)]
-            with open(filename, newline="", encoding="utf-8") as csvfile:
-                intronreader = csv.reader(csvfile, delimiter="\t")
-                for row in intronreader:
-                    seq_region = row[0]
-                    if row[3] == "2":
-                        intron_strand = -1
-                    else:
-                        intron_strand = 1
-                    intron_id = f"{row[1]}:{row[2]}:{intron_strand}:{row[4]}"
-                    depth = int(row[6]) + ceil(int(row[7]) / 2)
-                    if seq_region not in daf_table:
-                        daf_table[seq_region] = {}
-                    if intron_id not in daf_table[seq_region]:
-                        daf_table[seq_region][intron_id] = {}
-                    if logic_name in daf_table[seq_region][intron_id]:
-                        daf_table[seq_region][intron_id][logic_name] += depth
-                    else:
-                        daf_table[seq_region][intron_id][logic_name] = depth
-        except KeyError:
-            logger.error("Could not find analysis for file %s", filename)
+    # check the analysis first so files without one are not opened
+    logic_name = analyses.get(filename.name.partition("_")[0])
+    if logic_name is None:
+        logger.error("Could not find analysis for file %s", filename)
+        return daf_table
+
+    with open(
+        filename, newline="", encoding="utf-8", buffering=READ_BUFFER_SIZE
+    ) as csvfile:
+        intronreader = csv.reader(csvfile, delimiter="\t")
+        for (
+            seq_region,
+            start,
+            end,
+            strand,
+            motif,
+            unique_reads,
+            multi_reads,
+        ) in map(JUNCTION_COLUMNS, intronreader):
+            if strand == "2":
+                intron_strand = -1
+            else:
+                intron_strand = 1
+            intron_id = (int(start), int(end), intron_strand, int(motif))
+            depth = int(unique_reads) + ((int(multi_reads) + 1) >> 1)
+            # the names repeat on every row, sharing one string per name keeps the
+            # table small and lets pickle send each name once from the workers
+            key = (intern(seq_region), intron_id, logic_name)
+            daf_table[key] = daf_table.get(key, 0) + depth
+
+    return daf_table
+
+
+# analyses shared by the worker processes, set once per worker by _init_worker
+_ANALYSES: Dict[str, str] = {}
+
+
+def _init_worker(analyses: Dict[str, str]) -> None:
+    """Stores the analyses in the worker process so they are not sent with every file.
+
+    Args:
+        analyses: Dictionary of logic_name to assign depending on the filename.
+    """
+
+    global _ANALYSES  # pylint: disable=global-statement
+    _ANALYSES = analyses
+
+
+def _process_file_worker(filename: Path) -> Dict[Tuple[str, IntronId, str], int]:
+    """Parses a STAR junctions file in a worker process, see process_file.
+
+    Args:
+        filename: Path of file to process.
+
+    Returns:
+        A dictionary storing the intron information of the file.
+    """
+
+    return process_file(filename, _ANALYSES)
+
+
+def process_files(
+    filenames: Iterable[Path], analyses: Dict[str, str], num_threads: int = 1
+) -> Dict[Tuple[str, IntronId, str], int]:
+    """Parses STAR junctions files, in parallel when more than one thread is requested.
+
+    Each file is processed on its own and the results are added to a Counter as they
+    come back.
+    The analyses are sent once to each worker and the files are handed out in chunks.
+
+    Args:
+        filenames: Paths of the files to process.
+        analyses: Dictionary of logic_name to assign depending on the filename.
+        num_threads: Number of processes used to parse the files.
+
+    Returns:
+        A dictionary storing the intron information, see process_file.
+    """
+
+    daf_table: "Counter[Tuple[str, IntronId, str]]" = Counter()
+    if num_threads > 1:
+        filenames = list(filenames)
+        with ProcessPoolExecutor(
+            max_workers=num_threads, initializer=_init_worker, initargs=(analyses,)
+        ) as executor:
+            for file_daf_table in executor.map(
+                _process_file_worker,
+                filenames,
+                chunksize=max(1, len(filenames) // (num_threads * 4)),
+            ):
+                daf_table.update(file_daf_table)
+    else:
+        for filename in filenames:
+            process_file(filename, analyses, daf_table)
 
     return daf_table
 
 
+def load_daf_file(connection: Connection, daf_file: IO[str]) -> None:
+    """Loads the rows written to daf_file into the dna_align_feature table.
+
+    The columns which are the same for every row or derived from the coordinates
+    are set by the server. The file is emptied afterwards so it can be used for
+    the next batch.
+
+    Args:
+        connection: SQLAlchemy Connection object to the database, with local_infile enabled.
+        daf_file: Temporary TSV file with one dna_align_feature row per line.
+    """
+
+    daf_file.flush()
+    connection.execute(
+        db.text(
+            "LOAD DATA LOCAL INFILE :filename INTO TABLE dna_align_feature"
+            + " FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'"
+            + " (seq_region_id, @start, @end, seq_region_strand, hit_name, analysis_id, score)"
+            + " SET seq_region_start = @start, seq_region_end = @end,"
+            + " hit_start = 1, hit_end = @end - @start + 1, hit_strand = 1,"
+            + " align_type = 'ensembl', cigar_line = CONCAT(@end - @start + 1, 'M')"
+        ),
+        {"filename": daf_file.name},
+    )
+    daf_file.seek(0)
+    daf_file.truncate()
+
+
 def write_output(  # pylint: disable=too-many-locals
     engine: Engine,
     analyses: Dict[str, str],
     slices: Dict[str, int],
-    daf_table: Dict[str, Dict[str, Dict[str, int]]],
+    daf_table: Dict[Tuple[str, IntronId, str], int],
     batch_size: int,
 ) -> None:
     """Stores the analyses and the junction information into an Ensembl database.
 
-    Before inserting the data into the dna_align_feature table we disable the indexes
-    to speed up the load. The indexes are enabled after all the rows have been inserted.
+    Before loading the data into the dna_align_feature table we disable the indexes
+    to speed up the load. The indexes are enabled after all the rows have been loaded.
+    The rows are written to a temporary TSV file which is loaded with LOAD DATA LOCAL
+    INFILE every batch_size rows.
 
     Args:
         engine: SQLAlchemy Engine object to connect to the database.
         analyses: Dictionary where key is the file id and value is the logic_name.
         slices: Dictionary where key is the sequence name and value is the dbID.
         daf_table: Dictionary with the data to store in the dna_align_feature table.
-        batch_size: The number of rows of data for each insert.
+        batch_size: The number of rows of data for each load.
     """
 
-    metadata = db.MetaData()
-
-    analysis_table = db.Table("analysis", metadata, autoload=True, autoload_with=engine)
-    dna_align_feature_table = db.Table(
-        "dna_align_feature", metadata, autoload=True, autoload_with=engine
+    # only the columns used below, so the table does not need to be reflected
+    analysis_table = db.table(
+        "analysis",
+        db.column("analysis_id"),
+        db.column("logic_name"),
+        db.column("created"),
     )
     logger = logging.getLogger("star2introns")
+    # ALTER TABLE commits straight away, so the keys are disabled and enabled on
+    # their own connections outside of the transaction
+    logger.debug("Disable KEYS")
     with engine.connect() as connection:
-        logger.info("Inserting analyses")
-        analyses_id = {}
-        analysis_insert = (
-            analysis_table.insert(bind=db.bindparam("logic_name"))
-            .prefix_with("IGNORE")
-            .values({"created": db.sql.func.now()})
-        )
-        analysis_query = db.select([analysis_table.columns.analysis_id]).where(
-            analysis_table.columns.logic_name == db.bindparam("logic_name")
-        )
-        for analysis in analyses.keys():
-            connection.execute(analysis_insert, {"logic_name": analyses[analysis]})
-            # fetch the inserted analysis_id
-            analysis_results = connection.execute(
-                analysis_query, {"logic_name": analyses[analysis]}
-            ).fetchall()
-            analyses_id[analyses[analysis]] = analysis_results[0][0]
-
-        daf_insert = dna_align_feature_table.insert()
-        counter = 1
-        daf_values = []
-        logger.debug("Disable KEYS")
         connection.execute(db.text("ALTER TABLE dna_align_feature DISABLE KEYS"))
-        logger.info("Loading daf stuff")
-        for seq_region in daf_table.keys():
-            for intron_id in daf_table[seq_region].keys():
-                seq_region_data = intron_id.split(":")
-                for logic_name in daf_table[seq_region][intron_id].keys():
-                    if int(seq_region_data[3]) > 0:
+    try:
+        # a single commit so the batches are not committed one by one, the core
+        # tables are MyISAM so a failed load is not rolled back
+        with engine.begin() as connection:
+            logger.info("Inserting analyses")
+            logic_names = set(analyses.values())
+            analyses_id = {}
+            # an empty set would insert a row without logic_name
+            if logic_names:
+                # all the analyses in one statement, the existing ones are ignored
+                connection.execute(
+                    analysis_table.insert()
+                    .prefix_with("IGNORE")
+                    .values(
+                        [
+                            {"logic_name": logic_name, "created": db.sql.func.now()}
+                            for logic_name in logic_names
+                        ]
+                    )
+                )
+                # fetch the analysis_ids, inserted or not
+                analysis_query = db.select(
+                    analysis_table.columns.analysis_id,
+                    analysis_table.columns.logic_name,
+                ).where(analysis_table.columns.logic_name.in_(logic_names))
+                analyses_id = {
+                    logic_name: analysis_id
+                    for analysis_id, logic_name in connection.execute(analysis_query)
+                }
+
+            counter = 1
+            logger.info("Loading daf stuff")
+            with tempfile.NamedTemporaryFile(
+                "w", suffix=".tsv", encoding="utf-8"
+            ) as daf_file:
+                write_row = csv.writer(
+                    daf_file, delimiter="\t", lineterminator="\n"
+                ).writerow
+                for (
+                    (seq_region, (start, end, strand, motif), logic_name),
+                    score,
+                ) in daf_table.items():
+                    if motif > 0:
                         hit_name = f"{counter}:canon"
                     else:
                         hit_name = f"{counter}:non canon"
-                    daf_values.append(
-                        {
-                            "seq_region_id": slices[seq_region],
-                            "seq_region_start": seq_region_data[0],
-                            "seq_region_end": seq_region_data[1],
-                            "seq_region_strand": seq_region_data[2],
-                            "hit_name": hit_name,
-                            "hit_start": 1,
-                            "hit_end": (
-                                int(seq_region_data[1]) - int(seq_region_data[0]) + 1
-                            ),
-                            "hit_strand": 1,
-                            "align_type": "ensembl",
-                            "analysis_id": analyses_id[logic_name],
-                            "score": daf_table[seq_region][intron_id][logic_name],
-                            "cigar_line": f"{int(seq_region_data[1])-int(seq_region_data[0])+1}M",
-                        }
+                    write_row(
+                        (
+                            slices[seq_region],
+                            start,
+                            end,
+                            strand,
+                            hit_name,
+                            analyses_id[logic_name],
+                            score,
+                        )
                     )
                     if (counter % batch_size) == 0:
-                        connection.execute(daf_insert, daf_values)
-                        daf_values = []
+                        load_daf_file(connection, daf_file)
                         logger.debug("Loading daf stuff %d", counter)
                     counter += 1
-        if daf_values:
-            connection.execute(daf_insert, daf_values)
-            daf_values = []
-        logger.info("Stored %d daf stuff", counter)
+                if daf_file.tell():
+                    load_daf_file(connection, daf_file)
+            logger.info("Stored %d daf stuff", counter)
+    except Exception:
+        # keep the original error if the keys cannot be enabled either,
+        # e.g. when the database is unreachable
+        try:
+            with engine.connect() as connection:
+                connection.execute(db.text("ALTER TABLE dna_align_feature ENABLE KEYS"))
+        except db.exc.SQLAlchemyError as ex:
+            logger.error("Could not enable the dna_align_feature keys: %s", ex)
+        raise
+    with engine.connect() as connection:
         connection.execute(db.text("ALTER TABLE dna_align_feature ENABLE KEYS"))
-        logger.debug("KEYS enabled")
+    logger.debug("KEYS enabled")
 
 
 def main() -> None:
@@ -298,8 +425,14 @@ def main() -> None:
     parser.add_argument(
         "--batch_size",
         type=int,
-        help="Number of values to insert at each batch",
-        default=500,
+        help="Number of values to load at each batch",
+        default=100000,
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        help="Number of processes used to parse the junctions files",
+        default=1,
     )
     parser.add_argument(
         "--verbose", action="store_true", help="Print debugging message"
@@ -313,9 +446,9 @@ def main() -> None:
 
     analyses = get_analyses(args.tsv_file, args.species)
 
-    daf_table = {}
-    for filename in Path(args.junctions_dir).glob("*SJ.out.tab"):
-        process_file(filename, analyses, daf_table)
+    daf_table = process_files(
+        Path(args.junctions_dir).glob("*SJ.out.tab"), analyses, args.num_threads
+    )
 
     if len(daf_table) > 0:
         engine = get_engine(args.intron_db)
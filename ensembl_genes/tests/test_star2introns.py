@@ -0,0 +1,74 @@
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+import pytest
+
+from ensembl_genes import star2introns
+
+
+ANALYSES = {
+    "SRR1": "salmo_salar_liver_rnaseq_daf",
+    "SRR2": "salmo_salar_liver_rnaseq_daf",
+    "SRR3": "salmo_salar_heart_rnaseq_daf",
+}
+
+
+@pytest.fixture(name="junction_files")
+def fixture_junction_files(tmp_path):
+    """
+    Write a few STAR junctions files, two of them belonging to the same sample.
+    """
+    junctions = {
+        "SRR1_SJ.out.tab": [
+            "1\t100\t200\t1\t1\t0\t10\t3\t40",
+            "1\t300\t400\t2\t2\t0\t2\t0\t30",
+        ],
+        "SRR2_SJ.out.tab": ["1\t100\t200\t1\t1\t0\t5\t1\t40"],
+        "SRR3_SJ.out.tab": [
+            "1\t100\t200\t1\t1\t0\t1\t0\t40",
+            "2\t50\t90\t0\t0\t0\t4\t4\t20",
+        ],
+        "SRR4_SJ.out.tab": ["1\t100\t200\t1\t1\t0\t100\t0\t40"],
+    }
+    filenames = []
+    for name, lines in junctions.items():
+        filename = tmp_path / name
+        filename.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        filenames.append(filename)
+    return filenames
+
+
+EXPECTED = {
+    ("1", (100, 200, 1, 1), "salmo_salar_liver_rnaseq_daf"): 18,
+    ("1", (100, 200, 1, 1), "salmo_salar_heart_rnaseq_daf"): 1,
+    ("1", (300, 400, -1, 2), "salmo_salar_liver_rnaseq_daf"): 2,
+    ("2", (50, 90, 1, 0), "salmo_salar_heart_rnaseq_daf"): 6,
+}
+
+
+def test_process_files(junction_files):
+    """
+    Check that the depths are summed per sample and files without analysis are skipped.
+    """
+    assert star2introns.process_files(junction_files, ANALYSES) == EXPECTED
+
+
+def test_process_files_parallel(junction_files):
+    """
+    Check that parsing the files in several processes gives the same result.
+    """
+    assert star2introns.process_files(junction_files, ANALYSES, 2) == EXPECTED